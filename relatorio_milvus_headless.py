@@ -6,20 +6,22 @@ alertar técnicos via WhatsApp e atualizar a planilha mensal de horas.
 """
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, FrozenSet, List, Tuple
+import functools
+import gzip
 import io
 import logging
 import smtplib
-import socket
 import time
 import os # Importar os para deletar o arquivo
 import json
 
+import numpy as np
 import pandas as pd
-import pywhatkit as kit
 import requests
 from email.message import EmailMessage
 from logging.handlers import SMTPHandler
@@ -44,9 +46,9 @@ ASSUNTO_PADRAO = "Relatório de Atendimento Milvus"
 EMAIL_DESTINATARIO_LOG = [e.strip() for e in os.getenv("EMAIL_DESTINATARIO_LOG").split(',')]
 ASSUNTO_LOG_PADRAO = "Log de Execução - Script Relatório Milvus"
 LOG_FILE_NAME = "relatorio_milvus.log" # Nome do arquivo de log
-PYWHATKIT_DB_FILE = "PyWhatKit_DB.txt" # Nome do arquivo de DB do PyWhatKit
+LOG_TAMANHO_MAX_SEM_GZIP = 1 << 20 # Acima disso (1 MiB) o log vai compactado
 
-COLUNAS_PADRAO_A_EXCLUIR: List[str] = [
+COLUNAS_PADRAO_A_EXCLUIR: FrozenSet[str] = frozenset({
     "Categoria primária",
     "Categoria secundária",
     "contato",
@@ -62,14 +64,20 @@ COLUNAS_PADRAO_A_EXCLUIR: List[str] = [
     "Atendimento",
     "Atendimento em horário comercial?",
     "Atendimento externo?",
-]
+})
 NOME_COLUNA_TECNICO = "Técnico"
 NOME_COLUNA_TEMPO_ATENDIMENTO = "Tempo total de atendimento"
 
-TECNICOS_A_IGNORAR = [t.strip() for t in os.getenv("TECNICOS_A_IGNORAR_LIST").split(',')]
+TECNICOS_A_IGNORAR: FrozenSet[str] = frozenset(
+    t.strip() for t in os.getenv("TECNICOS_A_IGNORAR_LIST").split(',')
+)
 
 LIMITE_MINIMO_HORAS = "04:00"
 WHATSAPP_TECNICOS: Dict[str, str] = json.loads(os.getenv("WHATSAPP_TECNICOS_JSON"))
+WHATSAPP_CLOUD_TOKEN = os.getenv("WHATSAPP_CLOUD_TOKEN")
+WHATSAPP_PHONE_ID = os.getenv("WHATSAPP_PHONE_ID")
+WHATSAPP_API_ENDPOINT = f"https://graph.facebook.com/v20.0/{WHATSAPP_PHONE_ID}/messages"
+WHATSAPP_MAX_WORKERS = 16 # Envios de alerta simultâneos
 
 MESES_PT = [
     "Janeiro", "Fevereiro", "Março", "Abril", "Maio", "Junho", "Julho",
@@ -90,8 +98,37 @@ console_handler.setFormatter(log_formatter)
 console_handler.setLevel(logging.INFO)
 root_logger.addHandler(console_handler)
 
+
+class BufferedFileHandler(logging.FileHandler):
+    """
+    FileHandler que não dá flush a cada registro: as linhas ficam no buffer
+    do arquivo e só são gravadas em disco quando ele enche ou no close()
+    (chamado também pelo logging.shutdown() na saída do processo).
+    """
+
+    def __init__(self, filename: str, mode: str = "a", encoding: str | None = None,
+                 delay: bool = False, buffer_size: int = 1 << 16) -> None:
+        self.buffer_size = buffer_size
+        super().__init__(filename, mode, encoding, delay)
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=self.buffer_size,
+                    encoding=self.encoding, errors=self.errors)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if self.stream is None:
+            # Depois do close()/shutdown não reabre o arquivo, para que ele possa ser apagado
+            if self._closed:
+                return
+            self.stream = self._open()
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
 # Configurar o file handler
-file_handler = logging.FileHandler(LOG_FILE_NAME, encoding="utf-8")
+file_handler = BufferedFileHandler(LOG_FILE_NAME, encoding="utf-8", delay=True)
 file_handler.setFormatter(log_formatter)
 file_handler.setLevel(logging.INFO)
 root_logger.addHandler(file_handler)
@@ -104,25 +141,31 @@ root_logger.setLevel(logging.INFO)
 # ---------------------------------------------------------------------------
 
 
-def _build_retry(total: int = 3, backoff_factor: float = 0.5) -> Retry:
+def _build_retry(total: int = 3, backoff_factor: float = 0.5,
+                 allowed_methods: Tuple[str, ...] = ("GET", "POST")) -> Retry:
     return Retry(
         total=total,
         backoff_factor=backoff_factor,
         status_forcelist=[500, 502, 503, 504],
-        allowed_methods=["GET", "POST"],
+        allowed_methods=list(allowed_methods),
         raise_on_status=False,
     )
 
 
-def get_session() -> requests.Session:
+def get_session(retry: Retry | None = None, pool_maxsize: int = 10) -> requests.Session:
     session = requests.Session()
-    adapter = HTTPAdapter(max_retries=_build_retry())
+    adapter = HTTPAdapter(max_retries=retry or _build_retry(), pool_maxsize=pool_maxsize)
     session.mount("https://", adapter)
     session.mount("http://", adapter)
     return session
 
 
 SESSION = get_session()
+# Envio de mensagem não é idempotente: um 5xx depois de a Meta aceitar o POST
+# não pode virar alerta duplicado, então o POST desta sessão não é repetido.
+# O pool acompanha o número de threads dos alertas, para nenhuma conexão ser descartada.
+WHATSAPP_SESSION = get_session(_build_retry(allowed_methods=("GET",)),
+                               pool_maxsize=WHATSAPP_MAX_WORKERS)
 
 # ---------------------------------------------------------------------------
 # ⏲️ Funções utilitárias de tempo
@@ -131,39 +174,38 @@ SESSION = get_session()
 
 def hhmm_to_total_minutes(hhmm_str: str) -> int:
     try:
-        t = datetime.strptime(hhmm_str.strip(), "%H:%M")
-        return t.hour * 60 + t.minute
+        horas, _, minutos = hhmm_str.strip().partition(":")
+        return int(horas) * 60 + int(minutos)
     except Exception as exc:
         logging.error("Formato de tempo inválido '%s' (%s)", hhmm_str, exc)
         raise
 
 
+@functools.lru_cache(maxsize=2048)
 def total_minutes_to_hhmm(total_minutes: int) -> str:
     hours, minutes = divmod(int(total_minutes), 60)
     return f"{hours:02d}:{minutes:02d}"
 
-# ---------------------------------------------------------------------------
-# 🌐 Conectividade
-# ---------------------------------------------------------------------------
-
 
-def verificar_conexao() -> bool:
-    try:
-        socket.create_connection(("8.8.8.8", 53), timeout=3)
-        return True
-    except OSError as exc:
-        logging.error("❌ Erro de conexão de rede: %s", exc)
-        return False
+def _hhmm_to_min_vec(serie: pd.Series) -> pd.Series:
+    """
+    Versão vetorizada de hhmm_to_total_minutes para uma Series de 'HH:MM'.
+    Tempo em branco conta como 00:00, como o NaT que o pd.to_timedelta ignorava na soma.
+    """
+    serie = serie.fillna("00:00").str.strip()
+    # int32 nas horas: horas * 60 em int16 estouraria acima de 546h
+    horas = serie.str.slice(0, -3).astype("int32")
+    minutos = serie.str.slice(-2).astype("int16")
+    return horas * 60 + minutos
 
 # ---------------------------------------------------------------------------
 # 📡 API Milvus
 # ---------------------------------------------------------------------------
 
 
-def solicitar_dados_api(data_inicial: str, data_final: str) -> str:
-    if not verificar_conexao():
-        raise ConnectionError("Sem conexão à internet.")
-
+def solicitar_dados_api(data_inicial: str, data_final: str) -> bytes:
+    # Sem sondagem prévia de rede: falhas de conexão já chegam como
+    # requests.ConnectionError depois das tentativas do Retry da SESSION.
     headers = {"Authorization": API_TOKEN, "Content-Type": "application/json"}
     body = {
         "filtro_body": {
@@ -175,12 +217,12 @@ def solicitar_dados_api(data_inicial: str, data_final: str) -> str:
 
     logging.info("📡 Solicitando dados da API (%s)…", data_inicial)
     start = time.perf_counter()
-    resp = SESSION.post(API_ENDPOINT, headers=headers, json=body, timeout=30)
+    resp = SESSION.post(API_ENDPOINT, headers=headers, json=body, timeout=30, stream=True)
     duration = time.perf_counter() - start
 
     if resp.ok:
         logging.info("✅ Dados recebidos (%.1fs).", duration)
-        return resp.text
+        return resp.content
     else:
         logging.error("❌ API HTTP %s – %s", resp.status_code, resp.text[:200])
         resp.raise_for_status()
@@ -190,20 +232,25 @@ def solicitar_dados_api(data_inicial: str, data_final: str) -> str:
 # ---------------------------------------------------------------------------
 
 
-def processar_csv(csv_content: str) -> pd.DataFrame:
+def processar_csv(csv_content: bytes) -> pd.DataFrame:
     logging.info("🧠 Processando conteúdo CSV…")
-    df = pd.read_csv(io.StringIO(csv_content), sep=";", encoding="utf-8", on_bad_lines="skip")
+    df = pd.read_csv(
+        io.BytesIO(csv_content),
+        sep=";",
+        encoding="utf-8",
+        engine="c",
+        on_bad_lines="skip",
+        usecols=lambda c: c not in COLUNAS_PADRAO_A_EXCLUIR,
+        dtype={NOME_COLUNA_TEMPO_ATENDIMENTO: "string"},
+    )
 
-    cols_to_drop = [c for c in COLUNAS_PADRAO_A_EXCLUIR if c in df.columns]
-    if cols_to_drop:
-        df = df.drop(columns=cols_to_drop)
-        # logging.info("Colunas removidas: %s", ", ".join(cols_to_drop)) # Removida a mensagem de log
-    
     missing_cols = [c for c in (NOME_COLUNA_TECNICO, NOME_COLUNA_TEMPO_ATENDIMENTO) if c not in df.columns]
     if missing_cols:
         raise ValueError(f"Coluna(s) obrigatória(s) ausente(s): {missing_cols}")
 
-    df = df.sort_values(by=NOME_COLUNA_TECNICO).reset_index(drop=True)
+    # Poucos técnicos repetidos em muitas linhas: como categoria, os groupby
+    # trabalham sobre códigos inteiros em vez de fazer hash de cada string.
+    df[NOME_COLUNA_TECNICO] = df[NOME_COLUNA_TECNICO].astype("category")
     return df
 
 # ---------------------------------------------------------------------------
@@ -220,25 +267,31 @@ def inserir_totais_por_tecnico(df: pd.DataFrame) -> pd.DataFrame:
     - A coluna 'Técnico' fica vazia na linha total.
     - Demais colunas também ficam vazias, exceto o total de horas.
     """
-    blocos: List[pd.DataFrame] = []
-
-    for tecnico, grupo in df.groupby(NOME_COLUNA_TECNICO, sort=False):
-        blocos.append(grupo)
-
-        # Soma as horas do grupo (HH:MM ➜ minutos ➜ HH:MM)
-        total_min = (
-            grupo[NOME_COLUNA_TEMPO_ATENDIMENTO]
-            .str.split(":")
-            .apply(lambda x: int(x[0]) * 60 + int(x[1]))
-            .sum()
-        )
-        total_hhmm = total_minutes_to_hhmm(total_min)
-
-        linha_total = {col: "" for col in df.columns}
-        linha_total[NOME_COLUNA_TEMPO_ATENDIMENTO] = total_hhmm
-        blocos.append(pd.DataFrame([linha_total]))
-
-    return pd.concat(blocos, ignore_index=True)
+    if df.empty:
+        return df.copy()
+
+    # Posições das linhas de cada técnico, com os técnicos em ordem alfabética;
+    # a leitura por essas posições deixa os grupos contíguos sem ordenar o df
+    grupos = df.groupby(NOME_COLUNA_TECNICO, sort=True, observed=True).indices
+    if not grupos:  # nenhuma linha com técnico preenchido
+        return df.iloc[:0].copy()
+    ordem = np.concatenate(list(grupos.values()))
+    tamanhos = np.fromiter((len(idx) for idx in grupos.values()), dtype=np.intp, count=len(grupos))
+    fins = np.cumsum(tamanhos)
+    inicios = fins - tamanhos
+
+    # Minutos (HH:MM ➜ minutos) só das linhas que entram em algum grupo
+    minutos = _hhmm_to_min_vec(df[NOME_COLUNA_TEMPO_ATENDIMENTO].iloc[ordem]).to_numpy()
+    totais_min = np.add.reduceat(minutos, inicios, dtype=np.int64)
+
+    # Linhas de total: tudo vazio, exceto o total de horas
+    linhas_total = np.full((len(grupos), len(df.columns)), "", dtype=object)
+    linhas_total[:, df.columns.get_loc(NOME_COLUNA_TEMPO_ATENDIMENTO)] = [
+        total_minutes_to_hhmm(m) for m in totais_min
+    ]
+
+    valores = df.to_numpy(dtype=object)[ordem]
+    return pd.DataFrame(np.insert(valores, fins, linhas_total, axis=0), columns=df.columns)
 
 # ---------------------------------------------------------------------------
 # 🏁 Resumo por técnico
@@ -246,40 +299,40 @@ def inserir_totais_por_tecnico(df: pd.DataFrame) -> pd.DataFrame:
 
 
 def calcular_soma_por_tecnico(df: pd.DataFrame) -> pd.DataFrame:
-    df_work = df[~df[NOME_COLUNA_TECNICO].isin(TECNICOS_A_IGNORAR)].copy()
-    td = pd.to_timedelta(df_work[NOME_COLUNA_TEMPO_ATENDIMENTO] + ":00")
-    df_work["total_min"] = td.dt.total_seconds() // 60
+    df_work = df[~df[NOME_COLUNA_TECNICO].isin(TECNICOS_A_IGNORAR)]
+    tecnicos = df_work[NOME_COLUNA_TECNICO].cat.categories
 
-    resumo = (
-        df_work.groupby(NOME_COLUNA_TECNICO, sort=False)["total_min"].sum().reset_index()
-    )
-    resumo["Total Horas"] = resumo["total_min"].apply(total_minutes_to_hhmm)
-    return resumo[[NOME_COLUNA_TECNICO, "Total Horas"]]
+    # Soma por técnico direto sobre os códigos da categoria (-1 = técnico vazio)
+    codigos = df_work[NOME_COLUNA_TECNICO].cat.codes.to_numpy()
+    validos = codigos >= 0
+    codigos = codigos[validos]
+    minutos = _hhmm_to_min_vec(df_work[NOME_COLUNA_TEMPO_ATENDIMENTO][validos]).to_numpy()
+
+    totais_min = np.bincount(codigos, weights=minutos, minlength=len(tecnicos))
+    # Presença pela contagem de linhas, não pelo total: quem lançou 00:00 também entra
+    presentes = np.bincount(codigos, minlength=len(tecnicos)) > 0
+
+    return pd.DataFrame({
+        NOME_COLUNA_TECNICO: tecnicos[presentes],
+        "Total Horas": [total_minutes_to_hhmm(m) for m in totais_min[presentes]],
+    })
 
 # ---------------------------------------------------------------------------
 # ✉️  Geração do corpo de e-mail (texto + HTML)
 # ---------------------------------------------------------------------------
 
-def gerar_corpo_email(resumo: pd.DataFrame, data_str: str) -> tuple[str, str]:
-    """Retorna (texto_plano, html)"""
-    data_fmt = datetime.strptime(data_str, "%Y-%m-%d").strftime("%d/%m/%Y")
+# Textos fixos montados uma única vez; por chamada só são geradas as linhas da tabela.
+_EMAIL_TEXTO_TEMPLATE = (
+    "Prezados(as),\n\nConforme rotina diária, segue abaixo o informativo com o total de horas de atendimento registradas por cada colaborador no dia {data_fmt}:\n\n"
+    "{linhas}\n\n Atenciosamente,\nEquipe JDB Tecnologia"
+)
 
-    # ---------- Texto Plano ----------
-    linhas_txt = "\n".join(f"{row[NOME_COLUNA_TECNICO]}: {row['Total Horas']}"
-                           for _, row in resumo.iterrows())
-    texto = (
-        f"Prezados(as),\n\nConforme rotina diária, segue abaixo o informativo com o total de horas de atendimento registradas por cada colaborador no dia {data_fmt}:\n\n"
-        f"{linhas_txt}\n\n Atenciosamente,\nEquipe JDB Tecnologia"
-    )
+_EMAIL_LINHA_HTML_TEMPLATE = (
+    "<tr><td style='padding:4px 8px;border:1px solid #ccc'>{nome}</td>"
+    "<td style='padding:4px 8px;border:1px solid #ccc;text-align:center'>{horas}</td></tr>"
+)
 
-    # ---------- HTML ----------
-    linhas_html = "".join(
-        f"<tr><td style='padding:4px 8px;border:1px solid #ccc'>{row[NOME_COLUNA_TECNICO]}</td>"
-        f"<td style='padding:4px 8px;border:1px solid #ccc;text-align:center'>{row['Total Horas']}</td></tr>"
-        for _, row in resumo.iterrows()
-    )
-
-    html = f"""
+_EMAIL_HTML_TEMPLATE = """
     <html>
       <body style="font-family:Arial,Helvetica,sans-serif;font-size:14px">
         <p>Prezados(as),<br><br>
@@ -292,7 +345,7 @@ def gerar_corpo_email(resumo: pd.DataFrame, data_str: str) -> tuple[str, str]:
             </tr>
           </thead>
           <tbody>
-            {linhas_html}
+            {linhas}
           </tbody>
         </table>
         <p style="margin-top:16px">Qualquer dúvida, estamos à disposição.<br>
@@ -300,8 +353,72 @@ def gerar_corpo_email(resumo: pd.DataFrame, data_str: str) -> tuple[str, str]:
       </body>
     </html>
     """
+
+
+def gerar_corpo_email(resumo: pd.DataFrame, data_str: str) -> tuple[str, str]:
+    """Retorna (texto_plano, html)"""
+    data_fmt = datetime.strptime(data_str, "%Y-%m-%d").strftime("%d/%m/%Y")
+
+    nomes = resumo[NOME_COLUNA_TECNICO].to_numpy()
+    horas = resumo["Total Horas"].to_numpy()
+
+    # ---------- Texto Plano ----------
+    linhas_txt = "\n".join(f"{nome}: {hh}" for nome, hh in zip(nomes, horas))
+    texto = _EMAIL_TEXTO_TEMPLATE.format_map({"data_fmt": data_fmt, "linhas": linhas_txt})
+
+    # ---------- HTML ----------
+    linhas_html = "".join(
+        _EMAIL_LINHA_HTML_TEMPLATE.format_map({"nome": nome, "horas": hh})
+        for nome, hh in zip(nomes, horas)
+    )
+    html = _EMAIL_HTML_TEMPLATE.format_map({"data_fmt": data_fmt, "linhas": linhas_html})
     return texto, html
 
+
+_smtp_conn: smtplib.SMTP | None = None
+
+
+def _smtp_connect() -> smtplib.SMTP:
+    smtp = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
+    try:
+        smtp.starttls()
+        smtp.login(EMAIL_REMENTENTE, SENHA_REMENTENTE)
+    except Exception:
+        # Sem o "with", o socket precisa ser fechado à mão se o handshake falhar
+        smtp.close()
+        raise
+    return smtp
+
+
+def obter_smtp() -> smtplib.SMTP:
+    """
+    Retorna a conexão SMTP autenticada da execução, reaproveitando-a entre
+    o envio do relatório e o do log. Um NOOP confirma que o servidor não
+    derrubou a conexão ociosa; se derrubou, abre uma nova.
+    """
+    global _smtp_conn
+    if _smtp_conn is not None:
+        try:
+            if _smtp_conn.noop()[0] == 250:
+                return _smtp_conn
+        except (smtplib.SMTPException, OSError):
+            pass
+        fechar_smtp()
+    _smtp_conn = _smtp_connect()
+    return _smtp_conn
+
+
+def fechar_smtp() -> None:
+    global _smtp_conn
+    if _smtp_conn is None:
+        return
+    try:
+        _smtp_conn.quit()
+    except (smtplib.SMTPException, OSError):
+        _smtp_conn.close()
+    _smtp_conn = None
+
+
 def enviar_email_com_anexo(caminho: Path, corpo_email: tuple[str, str],
                            destinatarios: List[str], assunto: str) -> None:
     texto, html = corpo_email
@@ -316,10 +433,7 @@ def enviar_email_com_anexo(caminho: Path, corpo_email: tuple[str, str],
         msg.add_attachment(f.read(), maintype="application",
                            subtype="octet-stream", filename=caminho.name)
 
-    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as smtp:
-        smtp.starttls()
-        smtp.login(EMAIL_REMENTENTE, SENHA_REMENTENTE)
-        smtp.send_message(msg)
+    obter_smtp().send_message(msg)
     logging.info("✅ E-mail enviado.")
 
 
@@ -327,6 +441,14 @@ def enviar_email_com_anexo(caminho: Path, corpo_email: tuple[str, str],
 # 📲 WhatsApp
 # ---------------------------------------------------------------------------
 
+_WHATSAPP_TEMPLATE = (
+    "Olá {tecnico}, tudo bem?\n\nVerificamos que o apontamento de horas do dia {data_fmt} está abaixo do esperado, foram registradas {horas} de atendimento no último dia útil.\n"
+    "Pedimos, por gentileza, que revise as horas registradas e, se houver alguma pendência, que seja ajustada o quanto antes.\n"
+    "⚠️O registro diário das horas é fundamental para garantir a transparência dos atendimentos e o correto acompanhamento das atividades da equipe.⚠️\n\n"
+    "Agradecemos pela atenção e colaboração!\n"
+    "*Equipe JDB Tecnologia*"
+)
+
 
 def enviar_alerta_whatsapp(tecnico: str, horas: str, data_str: str) -> None:
     data_fmt = datetime.strptime(data_str, "%Y-%m-%d").strftime("%d/%m/%Y")
@@ -337,19 +459,27 @@ def enviar_alerta_whatsapp(tecnico: str, horas: str, data_str: str) -> None:
         logging.warning("Número de WhatsApp não cadastrado para %s", tecnico)
         return
 
-    mensagem = (
-        f"Olá {tecnico}, tudo bem?\n\nVerificamos que o apontamento de horas do dia {data_fmt} está abaixo do esperado, foram registradas {horas} de atendimento no último dia útil.\n"
-        "Pedimos, por gentileza, que revise as horas registradas e, se houver alguma pendência, que seja ajustada o quanto antes.\n"
-        "⚠️O registro diário das horas é fundamental para garantir a transparência dos atendimentos e o correto acompanhamento das atividades da equipe.⚠️\n\n"
-        "Agradecemos pela atenção e colaboração!\n"
-        "*Equipe JDB Tecnologia*"
-    )
+    mensagem = _WHATSAPP_TEMPLATE.format_map({"tecnico": tecnico, "data_fmt": data_fmt, "horas": horas})
+
+    headers = {"Authorization": f"Bearer {WHATSAPP_CLOUD_TOKEN}"}
+    body = {
+        "messaging_product": "whatsapp",
+        "to": numero.lstrip("+"),
+        "type": "text",
+        "text": {"body": mensagem},
+    }
 
     try:
-        kit.sendwhatmsg_instantly(numero, mensagem, wait_time=30, tab_close=True)
-        logging.info("WhatsApp enviado para %s", tecnico)
-    except Exception as exc:
+        resp = WHATSAPP_SESSION.post(WHATSAPP_API_ENDPOINT, headers=headers, json=body, timeout=10)
+    except requests.RequestException as exc:
         logging.error("Erro ao enviar WhatsApp para %s (%s)", tecnico, exc)
+        return
+
+    if resp.ok:
+        logging.info("WhatsApp enviado para %s", tecnico)
+    else:
+        logging.error("Erro ao enviar WhatsApp para %s (HTTP %s – %s)",
+                      tecnico, resp.status_code, resp.text[:200])
 
 # ---------------------------------------------------------------------------
 # 📊 Excel mensal
@@ -357,19 +487,45 @@ def enviar_alerta_whatsapp(tecnico: str, horas: str, data_str: str) -> None:
 
 
 def _mapear_planilha(ws) -> Tuple[Dict[str, int], Dict[int, int]]:
+    # Linha 2: cabeçalho com os técnicos a partir da coluna B
+    cabecalho = next(ws.iter_rows(min_row=2, max_row=2, min_col=2, values_only=True), ())
     tecnicos_col = {
-        (ws.cell(row=2, column=col).value or "").split(" ")[0].lower(): col
-        for col in range(2, ws.max_column + 1)
-        if ws.cell(row=2, column=col).value is not None
+        valor.split(" ")[0].lower(): col
+        for col, valor in enumerate(cabecalho, start=2)
+        if valor is not None
     }
+    # Coluna A: dias do mês a partir da linha 3
     dias_linha = {
-        int(ws.cell(row=row, column=1).value): row
-        for row in range(3, ws.max_row + 1)
-        if str(ws.cell(row=row, column=1).value).isdigit()
+        int(valor): row
+        for row, (valor,) in enumerate(ws.iter_rows(min_row=3, max_col=1, values_only=True), start=3)
+        if str(valor).isdigit()
     }
     return tecnicos_col, dias_linha
 
 
+def _montar_plano_planilha(resumo: pd.DataFrame, map_tecnico: Dict[str, int],
+                           linha_dia: int) -> List[Tuple[int, int, str]]:
+    """
+    Percorre o resumo uma única vez e devolve as células a gravar como
+    (linha, coluna, valor), separando a lógica de mapeamento da escrita.
+    """
+    tecnicos = resumo[NOME_COLUNA_TECNICO].astype(str)
+    mask = ~tecnicos.isin(TECNICOS_A_IGNORAR).to_numpy()
+    # Primeiro nome em minúsculas, como no cabeçalho mapeado por _mapear_planilha
+    chaves = tecnicos.str.split(" ").str[0].str.lower().to_numpy()[mask]
+    nomes = tecnicos.to_numpy()[mask]
+    horas_col = resumo["Total Horas"].to_numpy()[mask]
+
+    plano: List[Tuple[int, int, str]] = []
+    for chave, tecnico, horas in zip(chaves, nomes, horas_col):
+        col = map_tecnico.get(chave)
+        if col:
+            plano.append((linha_dia, col, horas))
+        else:
+            logging.warning("Técnico %s não encontrado no cabeçalho.", tecnico)
+    return plano
+
+
 def atualizar_planilha_mensal(resumo: pd.DataFrame, data_ref: datetime) -> None:
     ano = data_ref.strftime("%Y")
     mes_num = data_ref.strftime("%m")
@@ -393,15 +549,8 @@ def atualizar_planilha_mensal(resumo: pd.DataFrame, data_ref: datetime) -> None:
         logging.error("Dia %s não encontrado na coluna A.", dia)
         return
 
-    for _, row in resumo.iterrows():
-        tecnico = row[NOME_COLUNA_TECNICO]
-        if tecnico in TECNICOS_A_IGNORAR:
-            continue
-        col = map_tecnico.get(tecnico.split(" ")[0].lower())
-        if col:
-            ws.cell(row=linha_dia, column=col, value=row["Total Horas"])
-        else:
-            logging.warning("Técnico %s não encontrado no cabeçalho.", tecnico)
+    for row, col, valor in _montar_plano_planilha(resumo, map_tecnico, linha_dia):
+        ws.cell(row=row, column=col, value=valor)
 
     wb.save(planilha_path)
     logging.info("Planilha mensal atualizada.")
@@ -418,7 +567,9 @@ def salvar_csv(df: pd.DataFrame, data_ref: datetime) -> Path:
     pasta = BASE_PASTA_RELATORIOS / ano / f"{mes_num}-{mes_nome}"
     pasta.mkdir(parents=True, exist_ok=True)
     caminho = pasta / f"{data_ref:%d}.csv"
-    df.to_csv(caminho, sep=";", index=False, encoding="utf-8")
+    # Buffer grande e newline="" para não traduzir "\n" em "\r\n" no Windows
+    with open(caminho, "w", encoding="utf-8", newline="", buffering=1 << 20) as f:
+        df.to_csv(f, sep=";", index=False, lineterminator="\n")
     logging.info("💾 CSV salvo em %s", caminho)
     return caminho
 
@@ -456,10 +607,20 @@ def main() -> None:  # noqa: C901
         enviar_email_com_anexo(csv_path, corpo_email, DESTINATARIOS, assunto_final) # Usa assunto_final
 
         # Alertas WhatsApp
-        limite_min = hhmm_to_total_minutes(LIMITE_MINIMO_HORAS)
-        for _, row in resumo.iterrows():
-            if hhmm_to_total_minutes(row["Total Horas"]) <= limite_min:
-                enviar_alerta_whatsapp(row[NOME_COLUNA_TECNICO], row["Total Horas"], data_str)
+        # Resumo vazio (todos ignorados ou sem técnico): nenhum alerta a enviar
+        alertas: List[Tuple[str, str]] = []
+        if not resumo.empty:
+            limite_min = hhmm_to_total_minutes(LIMITE_MINIMO_HORAS)
+            abaixo_limite = resumo[_hhmm_to_min_vec(resumo["Total Horas"]) <= limite_min]
+            alertas = list(zip(abaixo_limite[NOME_COLUNA_TECNICO], abaixo_limite["Total Horas"]))
+        if alertas and not (WHATSAPP_CLOUD_TOKEN and WHATSAPP_PHONE_ID):
+            logging.error("WHATSAPP_CLOUD_TOKEN/WHATSAPP_PHONE_ID não configurados; "
+                          "%d alerta(s) de WhatsApp não enviado(s).", len(alertas))
+            alertas = []
+        if alertas:
+            # Envios HTTP independentes: em paralelo, a latência total fica ~1 RTT
+            with ThreadPoolExecutor(max_workers=min(WHATSAPP_MAX_WORKERS, len(alertas))) as executor:
+                list(executor.map(lambda a: enviar_alerta_whatsapp(*a, data_str), alertas))
 
         atualizar_planilha_mensal(resumo, data_ref)
 
@@ -468,11 +629,9 @@ def main() -> None:  # noqa: C901
     except Exception as exc:
         logging.critical("Erro fatal: %s", exc, exc_info=True)
     finally:
-        # Fechar o file_handler para liberar o arquivo antes de tentar deletá-lo
-        # Isso é crucial para resolver o erro WinError 32
-        if file_handler in root_logger.handlers:
-            file_handler.close()
-            root_logger.removeHandler(file_handler)
+        # Descarrega e fecha todos os handlers antes de anexar e apagar o log;
+        # com o arquivo fechado não há WinError 32 no os.remove
+        logging.shutdown()
 
         # Envia o arquivo de log completo por e-mail no final
         log_file_path = Path(LOG_FILE_NAME)
@@ -485,20 +644,28 @@ def main() -> None:  # noqa: C901
                 msg_log["To"] = ", ".join(EMAIL_DESTINATARIO_LOG)
                 msg_log.set_content("Log de execução do script 'relatorio_milvus'.") # Corpo simples
 
-                with log_file_path.open("rb") as f:
+                log_bytes = log_file_path.read_bytes()
+                if len(log_bytes) > LOG_TAMANHO_MAX_SEM_GZIP:
+                    # Logs grandes e repetitivos: gzip reduz bem mais que o base64 aumenta
                     msg_log.add_attachment(
-                        f.read(),
-                        maintype="text", # Tipo de conteúdo para um arquivo de texto
+                        gzip.compress(log_bytes),
+                        maintype="application",
+                        subtype="gzip",
+                        filename=f"{log_file_path.name}.gz",
+                    )
+                else:
+                    # Texto quase todo ASCII: quoted-printable fica menor que base64
+                    msg_log.add_attachment(
+                        log_bytes.decode("utf-8", errors="replace"),
                         subtype="plain",
+                        charset="utf-8",
+                        cte="quoted-printable",
+                        disposition="attachment",
                         filename=log_file_path.name,
                     )
                 
-                with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as smtp:
-                    smtp.starttls()
-                    smtp.login(EMAIL_REMENTENTE, SENHA_REMENTENTE)
-                    smtp.send_message(msg_log)
-                # Note: logging.info aqui pode não aparecer no log_file_path se o handler foi fechado
-                # Use print para garantir visibilidade no console
+                obter_smtp().send_message(msg_log)
+                # Após o logging.shutdown() os handlers estão fechados: usar print
                 print(f"✅ Log de execução enviado por e-mail para {', '.join(EMAIL_DESTINATARIO_LOG)}")
 
             except Exception as e:
@@ -509,18 +676,11 @@ def main() -> None:  # noqa: C901
                     os.remove(log_file_path)
                     print(f"Arquivo de log '{LOG_FILE_NAME}' deletado com sucesso.")
                 except OSError as e:
-                    print(f"Erro ao deletar arquivo de log '{LOG_FILE_NAME}': [WinError 32] O arquivo já está sendo usado por outro processo: '{LOG_FILE_NAME}' - {e}")
+                    print(f"Erro ao deletar arquivo de log '{LOG_FILE_NAME}': {e}")
         else:
             print(f"Arquivo de log '{LOG_FILE_NAME}' não encontrado para envio.")
-        
-        # --- NOVO: Deleta o arquivo PyWhatKit_DB.txt ---
-        pywhatkit_db_path = Path(PYWHATKIT_DB_FILE)
-        if pywhatkit_db_path.exists():
-            try:
-                os.remove(pywhatkit_db_path)
-                print(f"Arquivo '{PYWHATKIT_DB_FILE}' deletado com sucesso.")
-            except OSError as e:
-                print(f"Erro ao deletar arquivo '{PYWHATKIT_DB_FILE}': {e}")
+
+        fechar_smtp()
 
 
 if __name__ == "__main__":